@@ -0,0 +1,81 @@
+"""Measures time-to-first-handled-update for bot.py.
+
+Simulates a cold start the way our PaaS does it: import the bot, build the
+application, run the startup hook and then feed one group message through
+the handlers. No Telegram traffic is made. MongoDB does not have to be
+reachable (the default URL points at a closed port), which is the point:
+the first update must be handled without waiting for the database.
+
+    python bench_startup.py [runs]
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+# Runs in a fresh interpreter per measurement so import costs are included.
+CHILD = r"""
+import asyncio, time
+start = time.perf_counter()
+import bot
+imported = time.perf_counter()
+
+from datetime import datetime, timezone
+from telegram import Chat, Message, Update, User
+from telegram.ext import ExtBot
+
+# Application.initialize() validates the token with getMe; answer it locally instead.
+async def get_me(self, *args, **kwargs):
+    self._bot_user = User(id=123456, first_name="Bench", is_bot=True, username="bench_bot")
+    return self._bot_user
+ExtBot.get_me = get_me
+
+async def run():
+    # Same order as run_webhook(): initialize, post_init, then updates are processed.
+    app = bot.build_application("123456:bench")
+    await app.initialize()
+    await bot.on_startup(app)
+    started = time.perf_counter()
+
+    chat = Chat(id=-100123, type=Chat.SUPERGROUP, title="Bench group")
+    user = User(id=42, first_name="Bench", is_bot=False)
+    message = Message(message_id=1, date=datetime.now(timezone.utc), chat=chat, from_user=user, text="hello")
+    await app.process_update(Update(update_id=1, message=message))
+    handled = time.perf_counter()
+
+    print(f"{imported - start:.4f} {started - start:.4f} {handled - start:.4f}")
+    bot.mongo_client.close()
+    for task in asyncio.all_tasks() - {asyncio.current_task()}:
+        task.cancel()
+
+asyncio.run(run())
+"""
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    env = dict(os.environ)
+    env.setdefault("MONGODB_URL", "mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=30000")
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", CHILD],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.split()
+        results.append([float(value) for value in output])
+
+    print(f"{'':>28}{'min':>10}{'median':>10}")
+    for i, label in enumerate(["import bot", "startup hook done", "first update handled"]):
+        values = sorted(run[i] for run in results)
+        print(f"{label:>28}{values[0] * 1000:>8.1f}ms{values[len(values) // 2] * 1000:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,17 @@
 import logging
 import os
+import html
+import string
 import json
 import asyncio
-import motor.motor_asyncio
+import heapq
+import itertools
+import re
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone, time as dt_time
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from telegram import (
     Update,
     ChatPermissions,
@@ -14,39 +23,207 @@ from telegram.ext import (
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    TypeHandler,
+    ApplicationHandlerStop,
     ContextTypes,
     filters
 )
-from telegram.error import RetryAfter, Forbidden
+from telegram.error import RetryAfter, Forbidden, BadRequest
 import sys # Import sys module for exiting
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 ANNOUNCEMENT_TEXT = "📢 This is a recurring announcement."
+ANNOUNCEMENT_PIN_SECONDS = 300 # How long an announcement stays pinned before it is removed
+
+# Delayed job queue tuning
+JOB_POLL_INTERVAL = 5     # Seconds between polls when no jobs are due
+JOB_BATCH_SIZE = 100      # Maximum jobs claimed per poll
+JOB_LEASE_SECONDS = 60    # A claimed job becomes due again if not finished within this time
+JOB_MAX_ATTEMPTS = 5      # Jobs failing this many times are dropped
+JOB_CONCURRENCY = 10      # Jobs of one batch run at the same time, keeps a batch well inside its lease
+
+# Update de-duplication: Telegram re-delivers an update if the webhook answer is slow
+UPDATE_DEDUP_WINDOW = 600     # Seconds an update_id is remembered
+UPDATE_DEDUP_MAX_SIZE = 10000 # Upper bound on remembered update_ids
+
+# MongoDB startup: the bot serves updates before the database is reachable
+MONGO_EARLY_WRITE_BUFFER = 1000 # Chats (and language picks) whose pending write is kept in memory until MongoDB is connected
+MONGO_CONNECT_RETRY = 5         # Seconds between connection attempts at startup
+
+# /settings group list paging
+SETTINGS_PAGE_SIZE = 8  # Groups shown per page, also the number of chats checked per batch
+SETTINGS_MAX_SCAN = 40  # Chats checked at most for one page before showing what was found
+
+# Night mode: groups locked/unlocked daily in their own timezone
+NIGHT_DEFAULT_START = "23:00"
+NIGHT_DEFAULT_END = "07:00"
+NIGHT_DEFAULT_TZ = "UTC"
+NIGHT_BATCH_SIZE = 20     # Permission changes sent per batch
+NIGHT_BATCH_PAUSE = 1     # Seconds between batches, keeps us under Telegram's rate limits
+NIGHT_MAX_SLEEP = 3600    # Upper bound on one sleep, guards against wall clock jumps
+NIGHT_RETRY_DELAY = 10    # First retry delay after a failed transition, doubled per attempt up to NIGHT_MAX_SLEEP
+NIGHT_SETTINGS_FIELDS = ("enabled", "start", "end", "tz") # Set by admins; 'locked'/'saved_permissions' belong to the scheduler
+
+# Warns: escalation thresholds and expiry
+WARN_MUTE_AT = int(os.getenv("WARN_MUTE_AT", 3))         # Warns that get a user muted
+WARN_BAN_AT = int(os.getenv("WARN_BAN_AT", 5))           # Warns that get a user banned
+WARN_MUTE_SECONDS = int(os.getenv("WARN_MUTE_SECONDS", 86400))  # How long a warn mute lasts
+WARN_EXPIRY_SECONDS = int(os.getenv("WARN_EXPIRY_SECONDS", 7 * 86400))  # Warns reset after this long without a new one
+WARN_FLUSH_INTERVAL = 10  # Seconds between batched writes of changed counters
+
+# Localization
+LOCALES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "locales")
+DEFAULT_LANGUAGE = "en"
+LANGUAGE_CACHE_SIZE = 10000 # Users/groups whose language choice is kept in memory
+LANGUAGES = [
+    ("🇬🇧 English", "en"), ("🇮🇹 Italiano", "it"),
+    ("🇪🇸 Español", "es"), ("🇵🇹 Português", "pt"),
+    ("🇩🇪 Deutsch", "de"), ("🇫🇷 Français", "fr"),
+    ("🇷🇴 Română", "ro"), ("🇳🇱 Nederlands", "nl"),
+    ("🇨🇳 简体中文", "zh-hans"), ("🇺🇦 Українська", "uk"),
+    ("🇷🇺 Русский", "ru"), ("🇰🇿 Қазақ", "kk"),
+    ("🇹🇷 Türkçe", "tr"), ("🇮🇩 Indonesia", "id"),
+    ("🇦🇿 Azərbaycan", "az"), ("🇺🇿 O'zbekcha", "uz"),
+    ("🇺🇦 Uyghurche", "ug"), ("🇲🇾 Melayu", "ms"),
+    ("🇸🇴 Soomaali", "so"), ("🇦🇱 Shqipja", "sq"),
+    ("🇷🇸 Srpski", "sr"), ("🇬🇷 Ελληνικά", "el"),
+    ("🇪🇹 Amharic", "am"), ("🇵🇰 اردو", "ur"),
+    ("🇰🇷 한국어", "ko"), ("🇮🇷 فارسی", "fa"),
+    ("🇮🇳 తెలుగు", "te"), ("🇮🇳 ગુજરાતી", "gu"),
+    ("🇮🇳 ਪੰਜਾਬੀ", "pa"), ("🇮🇳 ಕನ್ನಡ", "kn"),
+    ("🇮🇳 മലയാളം", "ml"), ("🇮🇳 ଓଡ଼ିଆ", "or"),
+    ("🇧🇩 বাংলা", "bn")
+]
+# Language names without the flag, e.g. "it" -> "Italiano"
+LANGUAGE_NAMES = {code: label.split(" ", 1)[1] for label, code in LANGUAGES}
 
 # --- MongoDB Client and Collection ---
 mongo_client = None
 chat_collection = None
-
-async def init_mongo_client():
-    global mongo_client, chat_collection
+job_collection = None
+warn_collection = None
+user_collection = None
+
+# Set once MongoDB answered and indexes are ensured
+mongo_ready = asyncio.Event()
+# Chat writes issued before mongo_ready was set: chat_id -> ("upsert", title) or ("remove", None),
+# least recently updated first. Every group message upserts its chat, so only the latest write per
+# chat is kept.
+early_chat_writes = OrderedDict()
+# Language picks made before mongo_ready was set: (kind, id) -> lang, least recently updated first.
+# Any user can pick a language in private chat, so this is keyed and bounded like early_chat_writes.
+early_language_writes = OrderedDict()
+# Other (write function, args) pairs issued before mongo_ready was set, oldest first. These only come
+# from group admin actions (delayed jobs, night settings), are few, and must not be lost, so this queue
+# is never trimmed.
+early_writes = deque()
+
+def init_mongo_client():
+    """Creates the client and collection handles. No network I/O happens here."""
+    global mongo_client, chat_collection, job_collection, warn_collection, user_collection
     mongodb_url = os.getenv("MONGODB_URL")
     if not mongodb_url:
         raise RuntimeError("MONGODB_URL environment variable not set.")
-    
+
+    # Imported here so pymongo's import cost is not paid before the bot can start serving.
+    import motor.motor_asyncio
+
+    mongo_client = motor.motor_asyncio.AsyncIOMotorClient(mongodb_url)
+    db = mongo_client.get_database("telegram_bot_db")
+    chat_collection = db.get_collection("chat_ids")
+    job_collection = db.get_collection("delayed_jobs")
+    warn_collection = db.get_collection("warns")
+    user_collection = db.get_collection("users")
+    logger.info("MongoDB client and collection initialized.")
+
+async def connect_mongo():
+    """Waits for MongoDB, ensures indexes, then replays writes buffered in the meantime."""
     logger.info("Attempting to connect to MongoDB...")
-    try:
-        mongo_client = motor.motor_asyncio.AsyncIOMotorClient(mongodb_url)
-        db = mongo_client.get_database("telegram_bot_db")
-        chat_collection = db.get_collection("chat_ids")
-        
-        logger.info("MongoDB client and collection initialized.")
-        await chat_collection.create_index("chat_id", unique=True)
-        logger.info("MongoDB index on 'chat_id' created/ensured.")
-    except Exception as e:
-        logger.error(f"Failed to connect to MongoDB or initialize collection: {e}")
-        raise
+    while True:
+        try:
+            await mongo_client.admin.command("ping")
+            await chat_collection.create_index("chat_id", unique=True)
+            logger.info("MongoDB index on 'chat_id' created/ensured.")
+            await job_collection.create_index("due_at")
+            logger.info("MongoDB index on 'due_at' created/ensured.")
+            await warn_collection.create_index([("chat_id", 1), ("user_id", 1)], unique=True)
+            # MongoDB deletes expired warn counters by itself.
+            await warn_collection.create_index("expires_at", expireAfterSeconds=0)
+            logger.info("MongoDB indexes on 'warns' created/ensured.")
+            await user_collection.create_index("user_id", unique=True)
+            logger.info("MongoDB index on 'user_id' created/ensured.")
+            break
+        except Exception as e:
+            logger.error(f"Failed to connect to MongoDB or initialize collection: {e}. Retrying in {MONGO_CONNECT_RETRY} seconds.")
+            await asyncio.sleep(MONGO_CONNECT_RETRY)
+
+    # Writes made while replaying are still buffered and replayed by this loop, and mongo_ready is only
+    # set once both buffers are empty, so no direct write can overtake an older buffered one.
+    if early_chat_writes or early_language_writes or early_writes:
+        buffered = len(early_chat_writes) + len(early_language_writes) + len(early_writes)
+        logger.info(f"Replaying {buffered} writes buffered during startup.")
+    while early_chat_writes or early_language_writes or early_writes:
+        if early_chat_writes:
+            chat_id, (action, chat_title) = early_chat_writes.popitem(last=False)
+            func, args = (write_chat_id_to_mongo, (chat_id, chat_title)) if action == "upsert" else (delete_chat_id_from_mongo, (chat_id,))
+        elif early_language_writes:
+            (kind, entity_id), lang = early_language_writes.popitem(last=False)
+            func, args = write_language, (kind, entity_id, lang)
+        else:
+            func, args = early_writes.popleft()
+        try:
+            await func(*args)
+        except Exception as e:
+            logger.error(f"Failed to replay buffered write {func.__name__}{args}: {e}")
+    mongo_ready.set()
+
+async def require_mongo_ready(update: Update) -> bool:
+    """Tells the user to retry if MongoDB is not connected yet, rather than blocking every update behind a read."""
+    if mongo_ready.is_set():
+        return True
+    text = "⏳ The bot is still starting, please try again in a moment."
+    if update.callback_query:
+        await update.callback_query.answer(text, show_alert=True)
+    else:
+        await update.message.reply_text(text)
+    return False
+
+def buffer_early_chat_write(chat_id: int, action: str, chat_title: str = None) -> bool:
+    """Remembers the chat's latest upsert/removal if MongoDB is not ready yet. Returns False if the caller should write now."""
+    if mongo_ready.is_set():
+        return False
+    early_chat_writes[chat_id] = (action, chat_title)
+    early_chat_writes.move_to_end(chat_id)
+    if len(early_chat_writes) > MONGO_EARLY_WRITE_BUFFER:
+        # Losing this only delays tracking (or forgetting) the chat until it is seen again.
+        dropped_chat_id, (dropped_action, _) = early_chat_writes.popitem(last=False)
+        logger.warning(f"Startup chat buffer full, dropping {dropped_action} of chat {dropped_chat_id}.")
+    return True
+
+def buffer_early_language_write(kind: str, entity_id: int, lang: str) -> bool:
+    """Remembers the latest language pick of a user/chat if MongoDB is not ready yet. Returns False if the caller should write now."""
+    if mongo_ready.is_set():
+        return False
+    key = (kind, entity_id)
+    early_language_writes[key] = lang
+    early_language_writes.move_to_end(key)
+    if len(early_language_writes) > MONGO_EARLY_WRITE_BUFFER:
+        # The pick stays in language_cache for as long as it is not evicted; only persisting it is lost.
+        (dropped_kind, dropped_id), _ = early_language_writes.popitem(last=False)
+        logger.warning(f"Startup language buffer full, dropping language of {dropped_kind} {dropped_id}.")
+    return True
+
+def buffer_early_write(func, *args) -> bool:
+    """Queues func(*args) if MongoDB is not ready yet. Returns False if the caller should write now.
+
+    `func` must write directly (not buffer again), since it is also what the replay calls.
+    """
+    if mongo_ready.is_set():
+        return False
+    early_writes.append((func, args))
+    return True
 
 # --- MongoDB Interaction Functions ---
 
@@ -63,6 +240,11 @@ async def get_all_chat_ids_from_mongo():
 
 async def add_chat_id_to_mongo(chat_id: int, chat_title: str = None):
     """Adds a chat ID and title to the MongoDB collection if it doesn't already exist or updates the title."""
+    if buffer_early_chat_write(chat_id, "upsert", chat_title):
+        return
+    await write_chat_id_to_mongo(chat_id, chat_title)
+
+async def write_chat_id_to_mongo(chat_id: int, chat_title: str = None):
     try:
         result = await chat_collection.update_one(
             {"chat_id": chat_id},
@@ -80,6 +262,11 @@ async def add_chat_id_to_mongo(chat_id: int, chat_title: str = None):
 
 async def remove_chat_id_from_mongo(chat_id: int):
     """Removes a chat ID from the MongoDB collection."""
+    if buffer_early_chat_write(chat_id, "remove"):
+        return
+    await delete_chat_id_from_mongo(chat_id)
+
+async def delete_chat_id_from_mongo(chat_id: int):
     try:
         result = await chat_collection.delete_one({"chat_id": chat_id})
         if result.deleted_count > 0:
@@ -89,31 +276,408 @@ async def remove_chat_id_from_mongo(chat_id: int):
     except Exception as e:
         logger.error(f"Failed to remove chat ID {chat_id} from MongoDB: {e}")
 
+# --- Delayed Jobs ---
+#
+# Jobs are stored in the 'delayed_jobs' collection so they survive restarts
+# (including /reload). A single worker polls the 'due_at' index in batches.
+# Claiming a job pushes its 'due_at' forward by JOB_LEASE_SECONDS, so if the
+# process dies while running it, the job simply becomes due again: execution
+# is at-least-once and handlers must tolerate running twice.
+
+async def schedule_job(kind: str, payload: dict, delay: float):
+    """Stores a job of the given kind to be run after `delay` seconds."""
+    due_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+    if buffer_early_write(insert_job, kind, payload, due_at):
+        return
+    await insert_job(kind, payload, due_at)
+
+async def insert_job(kind: str, payload: dict, due_at: datetime):
+    try:
+        await job_collection.insert_one({
+            "kind": kind,
+            "payload": payload,
+            "due_at": due_at,
+            "attempts": 0,
+            "lease_owner": None,
+        })
+        logger.debug(f"Scheduled job '{kind}' {payload} for {due_at.isoformat()}.")
+    except Exception as e:
+        logger.error(f"Failed to schedule job '{kind}' {payload}: {e}")
+
+async def cancel_jobs(kind: str, **payload):
+    """Deletes pending jobs of the given kind whose payload has all the given values."""
+    if buffer_early_write(delete_jobs, kind, payload):
+        return
+    await delete_jobs(kind, payload)
+
+async def delete_jobs(kind: str, payload: dict):
+    query = {"kind": kind, **{f"payload.{field}": value for field, value in payload.items()}}
+    try:
+        result = await job_collection.delete_many(query)
+        if result.deleted_count:
+            logger.debug(f"Cancelled {result.deleted_count} '{kind}' jobs for {payload}.")
+    except Exception as e:
+        logger.error(f"Failed to cancel '{kind}' jobs for {payload}: {e}")
+
+async def claim_due_jobs(limit: int = JOB_BATCH_SIZE):
+    """Leases up to `limit` due jobs to this worker and returns them."""
+    now = datetime.now(timezone.utc)
+    due = await job_collection.find({"due_at": {"$lte": now}}, {"_id": 1})\
+        .sort("due_at", 1).limit(limit).to_list(length=limit)
+    if not due:
+        return []
+
+    ids = [doc["_id"] for doc in due]
+    lease_owner = uuid.uuid4().hex
+    # Only jobs still due are leased, so another worker that claimed one first keeps it.
+    await job_collection.update_many(
+        {"_id": {"$in": ids}, "due_at": {"$lte": now}},
+        {"$set": {"due_at": now + timedelta(seconds=JOB_LEASE_SECONDS), "lease_owner": lease_owner}}
+    )
+    return await job_collection.find({"_id": {"$in": ids}, "lease_owner": lease_owner}).to_list(length=limit)
+
+async def run_job(bot, job):
+    kind = job["kind"]
+    handler = JOB_HANDLERS.get(kind)
+    if handler is None:
+        logger.error(f"No handler for job '{kind}' ({job['_id']}). Dropping it.")
+        await job_collection.delete_one({"_id": job["_id"]})
+        return
+
+    try:
+        await handler(bot, job["payload"])
+    except RetryAfter as e:
+        logger.warning(f"Flood control while running job '{kind}': retrying in {e.retry_after} seconds.")
+        await job_collection.update_one(
+            {"_id": job["_id"]},
+            {"$set": {"due_at": datetime.now(timezone.utc) + timedelta(seconds=e.retry_after + 1)}}
+        )
+        return
+    except Exception as e:
+        attempts = job.get("attempts", 0) + 1
+        if attempts >= JOB_MAX_ATTEMPTS:
+            logger.error(f"Job '{kind}' {job['payload']} failed {attempts} times, dropping it: {e}")
+            await job_collection.delete_one({"_id": job["_id"]})
+        else:
+            backoff = min(2 ** attempts * JOB_POLL_INTERVAL, 3600)
+            logger.warning(f"Job '{kind}' {job['payload']} failed (attempt {attempts}), retrying in {backoff}s: {e}")
+            await job_collection.update_one(
+                {"_id": job["_id"]},
+                {"$set": {"due_at": datetime.now(timezone.utc) + timedelta(seconds=backoff), "attempts": attempts}}
+            )
+        return
+
+    await job_collection.delete_one({"_id": job["_id"]})
+    logger.debug(f"Job '{kind}' {job['payload']} done.")
+
+async def run_job_guarded(bot, job, semaphore: asyncio.Semaphore):
+    async with semaphore:
+        try:
+            await run_job(bot, job)
+        except Exception as e:
+            # Usually MongoDB being unreachable. The job stays leased and becomes due again when the lease runs out.
+            logger.error(f"Failed to run or update job '{job['kind']}' ({job['_id']}): {e}")
+
+async def delayed_job_worker(app):
+    await mongo_ready.wait()
+    while True:
+        try:
+            jobs = await claim_due_jobs()
+        except Exception as e:
+            logger.error(f"Failed to poll delayed jobs: {e}")
+            jobs = []
+
+        semaphore = asyncio.Semaphore(JOB_CONCURRENCY)
+        await asyncio.gather(*(run_job_guarded(app.bot, job, semaphore) for job in jobs))
+
+        # A full batch means more jobs are probably due, so poll again right away.
+        if len(jobs) < JOB_BATCH_SIZE:
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+
+async def job_remove_announcement(bot, payload):
+    chat_id = payload["chat_id"]
+    message_id = payload["message_id"]
+    try:
+        await bot.unpin_chat_message(chat_id=chat_id, message_id=message_id)
+    except Forbidden:
+        return
+    except Exception as e:
+        logger.warning(f"Failed to unpin message {message_id} in chat {chat_id}: {e}")
+    try:
+        await bot.delete_message(chat_id=chat_id, message_id=message_id)
+        logger.info(f"Unpinned and deleted message {message_id} in chat {chat_id}.")
+    except Forbidden:
+        return
+    except Exception as e:
+        # The message may already be gone (e.g. a previous run of this job); nothing left to do.
+        logger.warning(f"Failed to delete message {message_id} in chat {chat_id}: {e}")
+
+async def job_unmute(bot, payload):
+    chat_id = payload["chat_id"]
+    user_id = payload["user_id"]
+    try:
+        # Not the chat's default permissions: those allow nothing while night mode has the group locked.
+        await bot.restrict_chat_member(chat_id, user_id, permissions=ChatPermissions.all_permissions())
+        logger.info(f"Unmuted user {user_id} in chat {chat_id}.")
+    except Forbidden:
+        logger.info(f"Cannot unmute user {user_id} in chat {chat_id}: bot was kicked/blocked.")
+
+JOB_HANDLERS = {
+    "remove_announcement": job_remove_announcement,
+    "unmute": job_unmute,
+}
+
+# --- Warn Counters ---
+#
+# Every live warn counter is kept in memory so moderation never waits on MongoDB.
+# Changed counters are written in one bulk_write every WARN_FLUSH_INTERVAL
+# seconds. A counter expires WARN_EXPIRY_SECONDS after its last warn; expired
+# entries are dropped when looked up or during the next flush.
+
+warn_counts = {}    # (chat_id, user_id) -> (count, expires_at timestamp)
+dirty_warns = set() # keys changed since the last flush
+# Set once the stored counters are in warn_counts. Until then warn commands are refused and nothing is
+# flushed, otherwise a partial in-memory count would be escalated on or written over the stored one.
+warns_loaded = asyncio.Event()
+
+def get_warn_count(chat_id: int, user_id: int) -> int:
+    key = (chat_id, user_id)
+    entry = warn_counts.get(key)
+    if entry is None:
+        return 0
+    if entry[1] <= time.time():
+        del warn_counts[key]
+        return 0
+    return entry[0]
+
+def add_warn(chat_id: int, user_id: int) -> int:
+    """Adds a warn and returns the user's new warn count in that chat."""
+    count = get_warn_count(chat_id, user_id) + 1
+    warn_counts[(chat_id, user_id)] = (count, time.time() + WARN_EXPIRY_SECONDS)
+    dirty_warns.add((chat_id, user_id))
+    return count
+
+def remove_warn(chat_id: int, user_id: int):
+    """Takes back the latest warn, e.g. when the escalation it triggered failed."""
+    key = (chat_id, user_id)
+    count = get_warn_count(chat_id, user_id)
+    if count <= 1:
+        warn_counts.pop(key, None)
+    else:
+        warn_counts[key] = (count - 1, warn_counts[key][1])
+    dirty_warns.add(key)
+
+def reset_warns(chat_id: int, user_id: int):
+    warn_counts.pop((chat_id, user_id), None)
+    dirty_warns.add((chat_id, user_id))
+
+async def load_warns():
+    """Loads unexpired counters into warn_counts."""
+    now = datetime.now(timezone.utc)
+    # Read everything before touching warn_counts, so a failed read can simply be retried.
+    loaded = {}
+    async for doc in warn_collection.find({"expires_at": {"$gt": now}}):
+        expires_at = doc["expires_at"].replace(tzinfo=timezone.utc).timestamp()
+        loaded[(doc["chat_id"], doc["user_id"])] = (doc["count"], expires_at)
+
+    warn_counts.update(loaded)
+    logger.info(f"Loaded {len(loaded)} warn counters from MongoDB.")
+
+async def flush_warns():
+    if not warns_loaded.is_set():
+        return
+    from pymongo import DeleteOne, UpdateOne
+
+    keys = list(dirty_warns)
+    dirty_warns.clear()
+    now = time.time()
+    for key in [key for key, (_, expires_at) in warn_counts.items() if expires_at <= now]:
+        del warn_counts[key]
+    if not keys:
+        return
+
+    operations = []
+    for chat_id, user_id in keys:
+        entry = warn_counts.get((chat_id, user_id))
+        if entry is None:
+            operations.append(DeleteOne({"chat_id": chat_id, "user_id": user_id}))
+        else:
+            operations.append(UpdateOne(
+                {"chat_id": chat_id, "user_id": user_id},
+                {"$set": {"count": entry[0], "expires_at": datetime.fromtimestamp(entry[1], timezone.utc)}},
+                upsert=True
+            ))
+    try:
+        await warn_collection.bulk_write(operations, ordered=False)
+        logger.debug(f"Flushed {len(operations)} warn counters to MongoDB.")
+    except Exception as e:
+        logger.error(f"Failed to flush warn counters to MongoDB: {e}")
+        dirty_warns.update(keys)
+
+async def warn_flusher(app):
+    await mongo_ready.wait()
+    while True:
+        try:
+            await load_warns()
+            break
+        except Exception as e:
+            logger.error(f"Failed to load warn counters from MongoDB: {e}. Retrying in {MONGO_CONNECT_RETRY} seconds.")
+            await asyncio.sleep(MONGO_CONNECT_RETRY)
+    warns_loaded.set()
+    while True:
+        await asyncio.sleep(WARN_FLUSH_INTERVAL)
+        await flush_warns()
+
+# === Localization ===
+#
+# Catalogs are read from locales/<code>.json once at import. Languages in
+# LANGUAGES without a file are left out (and not offered) until one is added.
+# Missing or broken translations are filled from English at load time, so every
+# loaded catalog is complete and picking a string is two dict lookups.
+# Language choices are cached in an LRU so only a cache miss reaches MongoDB.
+
+def load_catalogs(locales_dir: str = LOCALES_DIR) -> dict:
+    def placeholders(text):
+        return {field for _, field, _, _ in string.Formatter().parse(text) if field is not None}
+
+    def read(code):
+        path = os.path.join(locales_dir, f"{code}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    default = read(DEFAULT_LANGUAGE)
+    catalogs = {}
+    for _, code in LANGUAGES:
+        translations = read(code)
+        if translations is None:
+            continue
+        messages = dict(default)
+        for key, text in translations.items():
+            if key not in default:
+                logger.warning(f"Unknown message '{key}' in {code}.json, ignoring it.")
+            elif placeholders(text) != placeholders(default[key]):
+                logger.warning(f"Message '{key}' in {code}.json has different placeholders than English, ignoring it.")
+            else:
+                messages[key] = text
+        catalogs[code] = messages
+    return catalogs
+
+MESSAGES = load_catalogs()
+# The languages offered in the language menu: those with a catalog
+AVAILABLE_LANGUAGES = [(label, code) for label, code in LANGUAGES if code in MESSAGES]
+
+def t(lang: str, key: str, **kwargs) -> str:
+    """Returns message `key` in language `lang`, formatted with kwargs."""
+    text = MESSAGES.get(lang, MESSAGES[DEFAULT_LANGUAGE])[key]
+    return text.format(**kwargs) if kwargs else text
+
+# ("user" | "chat", id) -> chosen language code, or None if none was chosen; least recently used first
+language_cache = OrderedDict()
+
+def cache_language(key: tuple, lang: str):
+    language_cache[key] = lang
+    language_cache.move_to_end(key)
+    if len(language_cache) > LANGUAGE_CACHE_SIZE:
+        language_cache.popitem(last=False)
+
+async def get_stored_language(kind: str, entity_id: int):
+    key = (kind, entity_id)
+    if key in language_cache:
+        language_cache.move_to_end(key)
+        return language_cache[key]
+    if not mongo_ready.is_set():
+        return None
+
+    try:
+        if kind == "chat":
+            doc = await chat_collection.find_one({"chat_id": entity_id}, {"lang": 1})
+        else:
+            doc = await user_collection.find_one({"user_id": entity_id}, {"lang": 1})
+    except Exception as e:
+        logger.error(f"Failed to fetch language of {kind} {entity_id} from MongoDB: {e}")
+        return None
+    lang = (doc or {}).get("lang")
+    cache_language(key, lang)
+    return lang
+
+async def store_language(kind: str, entity_id: int, lang: str):
+    cache_language((kind, entity_id), lang)
+    if buffer_early_language_write(kind, entity_id, lang):
+        return
+    await write_language(kind, entity_id, lang)
+
+async def write_language(kind: str, entity_id: int, lang: str):
+    try:
+        if kind == "chat":
+            await chat_collection.update_one({"chat_id": entity_id}, {"$set": {"lang": lang}}, upsert=True)
+        else:
+            await user_collection.update_one({"user_id": entity_id}, {"$set": {"lang": lang}}, upsert=True)
+    except Exception as e:
+        logger.error(f"Failed to store language of {kind} {entity_id} in MongoDB: {e}")
+
+async def get_update_language(update: Update) -> str:
+    """Groups use the group's language; private chats the user's choice, then their Telegram language."""
+    chat = update.effective_chat
+    if chat and chat.type in ["group", "supergroup"]:
+        return await get_stored_language("chat", chat.id) or DEFAULT_LANGUAGE
+
+    user = update.effective_user
+    if user is None:
+        return DEFAULT_LANGUAGE
+    lang = await get_stored_language("user", user.id)
+    if lang:
+        return lang
+    telegram_lang = (user.language_code or "").lower()
+    if telegram_lang in MESSAGES:
+        return telegram_lang
+    return telegram_lang.split("-")[0] if telegram_lang.split("-")[0] in MESSAGES else DEFAULT_LANGUAGE
+
+# === Update de-duplication ===
+
+# update_id -> monotonic time it was first seen, oldest first
+recent_update_ids = OrderedDict()
+
+def is_duplicate_update(update_id: int) -> bool:
+    """Remembers update_id and reports whether it was already seen within UPDATE_DEDUP_WINDOW."""
+    now = time.monotonic()
+    # Entries are in arrival order, so expired ones are always at the front.
+    while recent_update_ids:
+        oldest_id, seen_at = next(iter(recent_update_ids.items()))
+        if now - seen_at < UPDATE_DEDUP_WINDOW and len(recent_update_ids) < UPDATE_DEDUP_MAX_SIZE:
+            break
+        recent_update_ids.popitem(last=False)
+
+    if update_id in recent_update_ids:
+        return True
+    recent_update_ids[update_id] = now
+    return False
+
+async def drop_duplicate_updates(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if is_duplicate_update(update.update_id):
+        logger.info(f"Ignoring re-delivered update {update.update_id}.")
+        raise ApplicationHandlerStop
+
 # === Handler functions ===
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    lang = await get_update_language(update)
     keyboard = [
-        [InlineKeyboardButton("➕ Add me to a Group ➕", url="https://t.me/mygroupmanagement_bot?startgroup=true")],
+        [InlineKeyboardButton(t(lang, "btn_add_to_group"), url="https://t.me/mygroupmanagement_bot?startgroup=true")],
         [
-            InlineKeyboardButton("📣 Group", url="https://t.me/ghelp"),
-            InlineKeyboardButton("📢 Channel", url="https://t.me/ghelp")
+            InlineKeyboardButton(t(lang, "btn_group"), url="https://t.me/ghelp"),
+            InlineKeyboardButton(t(lang, "btn_channel"), url="https://t.me/ghelp")
         ],
         [
-            InlineKeyboardButton("🛠️ Support", callback_data="show_support_info"),
-            InlineKeyboardButton("ℹ️ Information", callback_data="show_info")
+            InlineKeyboardButton(t(lang, "btn_support"), callback_data="show_support_info"),
+            InlineKeyboardButton(t(lang, "btn_info"), callback_data="show_info")
         ],
-        [InlineKeyboardButton("🇬🇧 Languages 🇬🇧", callback_data="lang_menu")]
+        [InlineKeyboardButton(t(lang, "btn_languages"), callback_data="lang_menu")]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    msg = (
-        "👋🏻 Hi ❔!\n"
-        "@mygroupmanagement_bot is the most complete Bot to help you manage your groups easily and safely!\n\n"
-        "👉🏻 Add me in a Supergroup and promote me as Admin to let me get in action!\n\n"
-        "❓ WHICH ARE THE COMMANDS? ❓\n"
-        "Press /help to see all the commands and how they work!\n"
-        "📃 <a href='https://www.grouphelp.top/privacy'>Privacy policy</a>"
-    )
+    msg = t(lang, "start_text", name=html.escape(update.effective_user.first_name))
 
     if update.callback_query:
         query = update.callback_query
@@ -170,24 +734,16 @@ async def show_support_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def show_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
+    lang = await get_update_language(update)
 
     keyboard = [
-        [InlineKeyboardButton("Bot Support", url="https://t.me/colonel_support")],
-        [InlineKeyboardButton("Bot commands", callback_data="show_bot_commands")],
-        [InlineKeyboardButton("⬅️ Back", callback_data="back_to_main_menu")]
+        [InlineKeyboardButton(t(lang, "btn_bot_support"), url="https://t.me/colonel_support")],
+        [InlineKeyboardButton(t(lang, "btn_bot_commands"), callback_data="show_bot_commands")],
+        [InlineKeyboardButton(t(lang, "btn_back"), callback_data="back_to_main_menu")]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    info_message = (
-        "This bot helps you manage your Telegram groups with ease and security.\n\n"
-        "<b>Key Features:</b>\n"
-        "• User management (kick, ban, mute)\n"
-        "• Admin promotion/demotion\n"
-        "• Welcome messages for new members\n"
-        "• Customizable rules\n"
-        "• Periodic announcements to active groups\n\n"
-        "For more details on commands, use the /help command or click 'Bot commands' below.\n\n"
-    )
+    info_message = t(lang, "info_text")
 
     try:
         await query.edit_message_text(
@@ -206,19 +762,20 @@ async def show_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 async def welcome(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    lang = await get_update_language(update)
     for new_user in update.message.new_chat_members:
         if new_user.id == context.bot.id:
             chat_id = update.effective_chat.id
             chat_title = update.effective_chat.title
             await add_chat_id_to_mongo(chat_id, chat_title)
-            await update.message.reply_text(f"Hello everyone! Thanks for adding me to **{update.effective_chat.title}**. I'm here to help manage this group. Please make me an admin so I can function properly!", parse_mode="Markdown")
+            await update.message.reply_text(t(lang, "welcome_bot_added", title=update.effective_chat.title), parse_mode="Markdown")
         else:
             await update.message.reply_text(
-                f"Welcome, {new_user.full_name}! Please read /rules before chatting."
+                t(lang, "welcome_member", name=new_user.full_name)
             )
 
 async def rules(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = "Group Rules:\n1. Be respectful\n2. No spam\n3. Follow Telegram TOS"
+    text = t(await get_update_language(update), "rules_text")
     if update.callback_query:
         query = update.callback_query
         await query.answer()
@@ -232,17 +789,7 @@ async def rules(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    help_text = (
-        "/help - Show this message\n"
-        "/rules - Show group rules\n"
-        "/settings - Manage group settings (private chat only)\n"
-        "/reload - Restart the bot (admin only in groups)\n"
-        "/kick - Kick a user (reply only)\n"
-        "/ban - Ban a user (reply only)\n"
-        "/mute - Mute a user (reply only)\n"
-        "/promote - Promote user to admin (reply only)\n"
-        "/demote - Demote admin (reply only)"
-    )
+    help_text = t(await get_update_language(update), "help_text")
 
     if update.callback_query:
         query = update.callback_query
@@ -275,6 +822,7 @@ async def require_reply(update, context, action_name):
         return None
     if not await is_admin(update, update.message.from_user.id):
         await update.message.reply_text("Only admins can use this command.")
+        return None
     return update.message.reply_to_message.from_user
 
 async def kick(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -296,16 +844,37 @@ async def ban(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception as e:
             await update.message.reply_text(f"Failed to ban {user.full_name}. Error: {e}")
 
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+def parse_duration(text: str):
+    """Parses durations like '30s', '10m', '2h' or '1d' into seconds. A bare number means minutes."""
+    match = re.fullmatch(r"(\d+)([smhd]?)", text.strip().lower())
+    if not match:
+        return None
+    return int(match.group(1)) * DURATION_UNITS[match.group(2) or "m"]
+
 async def mute(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = await require_reply(update, context, "mute")
     if user:
+        duration = None
+        if context.args:
+            duration = parse_duration(context.args[0])
+            if not duration:
+                await update.message.reply_text("Invalid duration. Use e.g. /mute 30m, /mute 2h or /mute 1d.")
+                return
         try:
             await context.bot.restrict_chat_member(
                 update.effective_chat.id,
                 user.id,
                 permissions=ChatPermissions(can_send_messages=False),
             )
-            await update.message.reply_text(f"Muted {user.full_name}")
+            # A new mute replaces the previous one, including its scheduled end.
+            await cancel_jobs("unmute", chat_id=update.effective_chat.id, user_id=user.id)
+            if duration:
+                await schedule_job("unmute", {"chat_id": update.effective_chat.id, "user_id": user.id}, duration)
+                await update.message.reply_text(f"Muted {user.full_name} for {context.args[0]}")
+            else:
+                await update.message.reply_text(f"Muted {user.full_name}")
         except Exception as e:
             await update.message.reply_text(f"Failed to mute {user.full_name}. Error: {e}")
 
@@ -345,92 +914,209 @@ async def demote(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception as e:
             await update.message.reply_text(f"Failed to demote {user.full_name}. Error: {e}")
 
+async def require_warns_loaded(update: Update) -> bool:
+    if not warns_loaded.is_set():
+        await update.message.reply_text("Warns are still loading, please try again in a moment.")
+        return False
+    return True
+
+async def warn(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = await require_reply(update, context, "warn")
+    if user and await require_warns_loaded(update):
+        chat_id = update.effective_chat.id
+        count = add_warn(chat_id, user.id)
+        reason = f"\nReason: {' '.join(context.args)}" if context.args else ""
+        try:
+            if count >= WARN_BAN_AT:
+                await context.bot.ban_chat_member(chat_id, user.id)
+            elif count == WARN_MUTE_AT:
+                await context.bot.restrict_chat_member(
+                    chat_id,
+                    user.id,
+                    permissions=ChatPermissions(can_send_messages=False),
+                )
+        except Exception as e:
+            # Not counting the warn keeps the mute/ban threshold reachable on the next /warn.
+            remove_warn(chat_id, user.id)
+            await update.message.reply_text(f"Failed to warn {user.full_name}. Error: {e}")
+            return
+
+        if count >= WARN_BAN_AT:
+            reset_warns(chat_id, user.id)
+            await update.message.reply_text(f"🚫 {user.full_name} reached {count} warns and has been banned.{reason}")
+        elif count == WARN_MUTE_AT:
+            await cancel_jobs("unmute", chat_id=chat_id, user_id=user.id)
+            await schedule_job("unmute", {"chat_id": chat_id, "user_id": user.id}, WARN_MUTE_SECONDS)
+            await update.message.reply_text(f"🔇 {user.full_name} reached {count}/{WARN_BAN_AT} warns and has been muted.{reason}")
+        else:
+            await update.message.reply_text(f"⚠️ {user.full_name} has been warned ({count}/{WARN_BAN_AT}).{reason}")
+
+async def unwarn(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = await require_reply(update, context, "unwarn")
+    if user and await require_warns_loaded(update):
+        reset_warns(update.effective_chat.id, user.id)
+        await update.message.reply_text(f"Removed all warns of {user.full_name}.")
+
+async def warns(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = await require_reply(update, context, "warns")
+    if user and await require_warns_loaded(update):
+        count = get_warn_count(update.effective_chat.id, user.id)
+        await update.message.reply_text(f"{user.full_name} has {count}/{WARN_BAN_AT} warns.")
+
 # === Language Menu Functions ===
 
 async def lang_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
+    lang = await get_update_language(update)
 
-    languages = [
-        ("🇬🇧 English", "en"), ("🇮🇹 Italiano", "it"),
-        ("🇪🇸 Español", "es"), ("🇵🇹 Português", "pt"),
-        ("🇩🇪 Deutsch", "de"), ("🇫🇷 Français", "fr"),
-        ("🇷🇴 Română", "ro"), ("🇳🇱 Nederlands", "nl"),
-        ("🇨🇳 简体中文", "zh-hans"), ("🇺🇦 Українська", "uk"),
-        ("🇷🇺 Русский", "ru"), ("🇰🇿 Қазақ", "kk"),
-        ("🇹🇷 Türkçe", "tr"), ("🇮🇩 Indonesia", "id"),
-        ("🇦🇿 Azərbaycan", "az"), ("🇺🇿 O'zbekcha", "uz"),
-        ("🇺🇦 Uyghurche", "ug"), ("🇲🇾 Melayu", "ms"),
-        ("🇸🇴 Soomaali", "so"), ("🇦🇱 Shqipja", "sq"),
-        ("🇷🇸 Srpski", "sr"), ("🇬🇷 Ελληνικά", "el"),
-        ("🇪🇹 Amharic", "am"), ("🇵🇰 اردو", "ur"),
-        ("🇰🇷 한국어", "ko"), ("🇮🇷 فارسی", "fa"),
-        ("🇮🇳 తెలుగు", "te"), ("🇮🇳 ગુજરાતી", "gu"),
-        ("🇮🇳 ਪੰਜਾਬੀ", "pa"), ("🇮🇳 ಕನ್ನಡ", "kn"),
-        ("🇮🇳 മലയാളം", "ml"), ("🇮🇳 ଓଡ଼ିଆ", "or"),
-        ("🇧🇩 বাংলা", "bn")
-    ]
+    # Opened from a group's settings ("setting_lang:<chat_id>") the choice applies to that group.
+    chat_suffix = ""
+    back_callback = "back_to_main_menu"
+    if query.data.startswith("setting_lang:"):
+        chat_id = query.data.split(":")[1]
+        chat_suffix = f":{chat_id}"
+        back_callback = f"group_settings:{chat_id}"
 
     keyboard = []
-    for i in range(0, len(languages), 2):
+    for i in range(0, len(AVAILABLE_LANGUAGES), 2):
         row = []
-        row.append(InlineKeyboardButton(languages[i][0], callback_data=f"set_lang:{languages[i][1]}"))
-        if i + 1 < len(languages):
-            row.append(InlineKeyboardButton(languages[i+1][0], callback_data=f"set_lang:{languages[i+1][1]}"))
+        row.append(InlineKeyboardButton(AVAILABLE_LANGUAGES[i][0], callback_data=f"set_lang:{AVAILABLE_LANGUAGES[i][1]}{chat_suffix}"))
+        if i + 1 < len(AVAILABLE_LANGUAGES):
+            row.append(InlineKeyboardButton(AVAILABLE_LANGUAGES[i+1][0], callback_data=f"set_lang:{AVAILABLE_LANGUAGES[i+1][1]}{chat_suffix}"))
         keyboard.append(row)
     
-    keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="back_to_main_menu")])
+    keyboard.append([InlineKeyboardButton(t(lang, "btn_back"), callback_data=back_callback)])
 
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     try:
         await query.edit_message_text(
-            text="Choose your language:",
+            text=t(lang, "choose_language"),
             reply_markup=reply_markup
         )
     except Exception as e:
         logger.warning(f"Failed to edit message in lang_menu: {e}. Sending new new message instead.")
         await query.message.reply_text(
-            text="Choose your language:",
+            text=t(lang, "choose_language"),
             reply_markup=reply_markup
         )
 
 async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
-    
-    lang_code = query.data.split(":")[1]
-    
-    language_names = {
-        "en": "English", "it": "Italiano", "es": "Español", "pt": "Português",
-        "de": "Deutsch", "fr": "Français", "ro": "Română", "nl": "Nederlands",
-        "zh-hans": "简体中文", "uk": "Українська", "ru": "Русский", "kk": "Қазақ",
-        "tr": "Türkçe", "id": "Indonesia", "az": "Azərbaycan", "uz": "O'zbekcha",
-        "ug": "Uyghurche", "ms": "Melayu", "so": "Soomaali", "sq": "Shqipja",
-        "sr": "Srpski", "el": "Ελληνικά", "am": "Amharic", "ur": "اردو",
-        "ko": "한국어", "fa": "فارسی", "te": "తెలుగు", "gu": "ગુજરાતી",
-        "pa": "ਪੰਜਾਬੀ", "kn": "ಕನ್ನಡ", "ml": "മലയാളം", "or": "ଓଡ଼ିଆ",
-        "bn": "বাংলা"
-    }
-    
-    chosen_language_name = language_names.get(lang_code, "Unknown")
     
-    confirmation_message = f"Language set to {chosen_language_name}."
+    parts = query.data.split(":")
+    lang_code = parts[1]
+    if lang_code not in MESSAGES:
+        await query.answer()
+        return
+
+    if len(parts) > 2:
+        # Language of a group, picked from its settings in private chat
+        chat_id = int(parts[2])
+        try:
+            chat_admins = await context.bot.get_chat_administrators(chat_id)
+        except (Forbidden, BadRequest) as e:
+            logger.info(f"Could not fetch admins of chat {chat_id} for its language: {e}")
+            await query.answer("I can't reach that group anymore. Am I still a member?", show_alert=True)
+            return
+        if not any(admin.user.id == query.from_user.id for admin in chat_admins):
+            await query.answer("Only admins of that group can change this.", show_alert=True)
+            return
+        await store_language("chat", chat_id, lang_code)
+        back_button = InlineKeyboardButton(t(lang_code, "btn_back"), callback_data=f"group_settings:{chat_id}")
+    else:
+        await store_language("user", query.from_user.id, lang_code)
+        back_button = InlineKeyboardButton(t(lang_code, "btn_back_to_main_menu"), callback_data="back_to_main_menu")
+    await query.answer()
+
+    confirmation_message = t(lang_code, "language_set", language=LANGUAGE_NAMES[lang_code])
 
     try:
         await query.edit_message_text(
             text=confirmation_message,
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back to Main Menu", callback_data="back_to_main_menu")]])
+            reply_markup=InlineKeyboardMarkup([[back_button]])
         )
     except Exception as e:
         logger.warning(f"Failed to edit message in set_language: {e}. Sending new message instead.")
         await query.message.reply_text(
             text=confirmation_message,
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back to Main Menu", callback_data="back_to_main_menu")]])
+            reply_markup=InlineKeyboardMarkup([[back_button]])
         )
 
 # --- /settings command and related functions ---
 
+async def can_manage_chat(context: ContextTypes.DEFAULT_TYPE, chat_doc: dict, user_id: int) -> bool:
+    """Checks that the bot is still in the chat and the user administers it. Forgets chats the bot left."""
+    chat_id = chat_doc['chat_id']
+    chat_title = chat_doc.get('chat_title', f"Unknown Chat ({chat_id})")
+
+    try:
+        # Check if the bot is still a member of the chat
+        bot_member = await context.bot.get_chat_member(chat_id=chat_id, user_id=context.bot.id)
+        if bot_member.status in ["member", "administrator", "creator"]:
+            # Check if the user is an admin in that group
+            # When checking for admin in the settings command (private chat),
+            # we don't have effective_chat directly from the update.
+            # So we must use context.bot.get_chat_administrators(chat_id)
+            chat_admins = await context.bot.get_chat_administrators(chat_id)
+            return any(admin.user.id == user_id for admin in chat_admins)
+        else:
+            logger.info(f"Bot is no longer a member of chat {chat_id} ('{chat_title}'). Removing from MongoDB.")
+            await remove_chat_id_from_mongo(chat_id)
+    except Forbidden:
+        logger.info(f"Bot was kicked/blocked from chat {chat_id} ('{chat_title}'). Removing from MongoDB.")
+        await remove_chat_id_from_mongo(chat_id)
+    except Exception as e:
+        logger.warning(f"Could not retrieve chat info for {chat_id} ('{chat_title}'): {e}")
+        # Optionally, remove chat if it consistently fails
+        # await remove_chat_id_from_mongo(chat_id) # Consider removing if errors persist
+    return False
+
+async def find_admin_groups_page(context: ContextTypes.DEFAULT_TYPE, user_id: int, cursor: int = None, backwards: bool = False):
+    """
+    Walks tracked chats in chat_id order, starting after `cursor` (or before it when going
+    backwards), and collects up to SETTINGS_PAGE_SIZE chats the user administers.
+
+    Chats are checked one batch at a time and the walk stops once the page is full or
+    SETTINGS_MAX_SCAN chats were checked, so the cost depends on the page size and not on
+    how many chats are tracked. Returns (groups, lowest, highest) where groups is a list of
+    chat documents in chat_id order and lowest/highest are the chat_ids bounding the part of
+    the collection this page covers (None if it covers nothing).
+    """
+    order = -1 if backwards else 1
+    groups = []
+    consumed = []
+
+    while len(groups) < SETTINGS_PAGE_SIZE and len(consumed) < SETTINGS_MAX_SCAN:
+        query = {}
+        if consumed:
+            cursor = consumed[-1]
+        if cursor is not None:
+            query = {"chat_id": {"$lt" if backwards else "$gt": cursor}}
+
+        batch = await chat_collection.find(query, {"chat_id": 1, "chat_title": 1})\
+            .sort("chat_id", order).limit(SETTINGS_PAGE_SIZE).to_list(length=SETTINGS_PAGE_SIZE)
+        if not batch:
+            break
+
+        allowed = await asyncio.gather(*(can_manage_chat(context, chat_doc, user_id) for chat_doc in batch))
+        for chat_doc, is_allowed in zip(batch, allowed):
+            if len(groups) == SETTINGS_PAGE_SIZE:
+                break
+            consumed.append(chat_doc['chat_id'])
+            if is_allowed:
+                groups.append(chat_doc)
+
+        if len(batch) < SETTINGS_PAGE_SIZE:
+            break
+
+    if backwards:
+        groups.reverse()
+    if not consumed:
+        return groups, None, None
+    return groups, min(consumed), max(consumed)
+
 async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
 
@@ -441,6 +1127,9 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Group Settings\n\nPress 'Open in pvt' to manage settings for groups you administer.", reply_markup=reply_markup)
         return
 
+    if not await require_mongo_ready(update):
+        return
+
     # In private chat, list groups where the bot is an admin
     settings_message = (
         "<b>Group Settings</b>\n"
@@ -450,37 +1139,34 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         " • Send /settings in the group and then press \"Open in pvt\""
     )
 
-    keyboard = []
-    # Fetch all chat IDs and titles from the database
-    all_tracked_chats = await chat_collection.find().to_list(length=None)
+    # Pages are addressed by the chat_id they start after ('>') or end before ('<'),
+    # e.g. "settings_page:>-1001234" for the page following chat -1001234.
+    cursor = None
+    backwards = False
+    if update.callback_query and update.callback_query.data.startswith("settings_page:"):
+        page_ref = update.callback_query.data.split(":")[1]
+        backwards = page_ref[0] == "<"
+        cursor = int(page_ref[1:])
+
+    groups, lowest, highest = await find_admin_groups_page(context, user_id, cursor, backwards)
 
-    for chat_doc in all_tracked_chats:
+    keyboard = []
+    for chat_doc in groups:
         chat_id = chat_doc['chat_id']
         chat_title = chat_doc.get('chat_title', f"Unknown Chat ({chat_id})")
-
-        try:
-            # Check if the bot is still a member of the chat
-            bot_member = await context.bot.get_chat_member(chat_id=chat_id, user_id=context.bot.id)
-            if bot_member.status in ["member", "administrator", "creator"]:
-                # Check if the user is an admin in that group
-                # When checking for admin in the settings command (private chat),
-                # we don't have effective_chat directly from the update.
-                # So we must use context.bot.get_chat_administrators(chat_id)
-                chat_admins = await context.bot.get_chat_administrators(chat_id)
-                if any(admin.user.id == user_id for admin in chat_admins):
-                    keyboard.append([InlineKeyboardButton(chat_title, callback_data=f"group_settings:{chat_id}")])
-            else:
-                logger.info(f"Bot is no longer a member of chat {chat_id} ('{chat_title}'). Removing from MongoDB.")
-                await remove_chat_id_from_mongo(chat_id)
-        except Forbidden:
-            logger.info(f"Bot was kicked/blocked from chat {chat_id} ('{chat_title}'). Removing from MongoDB.")
-            await remove_chat_id_from_mongo(chat_id)
-        except Exception as e:
-            logger.warning(f"Could not retrieve chat info for {chat_id} ('{chat_title}'): {e}")
-            # Optionally, remove chat if it consistently fails
-            # await remove_chat_id_from_mongo(chat_id) # Consider removing if errors persist
-
-    if not keyboard:
+        keyboard.append([InlineKeyboardButton(chat_title, callback_data=f"group_settings:{chat_id}")])
+
+    navigation = []
+    if lowest is not None and await chat_collection.find_one({"chat_id": {"$lt": lowest}}, {"_id": 1}):
+        navigation.append(InlineKeyboardButton("◀️ Prev", callback_data=f"settings_page:<{lowest}"))
+    if highest is not None and await chat_collection.find_one({"chat_id": {"$gt": highest}}, {"_id": 1}):
+        navigation.append(InlineKeyboardButton("Next ▶️", callback_data=f"settings_page:>{highest}"))
+    if navigation:
+        keyboard.append(navigation)
+
+    if not groups and navigation:
+        settings_message += "\n\n<i>No groups on this page, use the buttons below to keep looking.</i>"
+    elif not groups:
         settings_message += "\n\n<i>No groups found where you are an administrator and the bot is present.</i>"
 
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -522,6 +1208,8 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def show_group_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
+    if not await require_mongo_ready(update):
+        return
     await query.answer()
     
     chat_id_str = query.data.split(":")[1]
@@ -649,6 +1337,320 @@ async def show_other_settings(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
 
 
+# === Night mode ===
+#
+# A group's schedule is stored under 'night' in its chat_ids document:
+#   {"enabled": bool, "start": "HH:MM", "end": "HH:MM", "tz": "Area/City",
+#    "locked": bool, "saved_permissions": {...}}
+# All groups share one timer: night_heap holds each group's next transition as
+# (due timestamp, version, chat_id, lock) and night_scheduler sleeps until the
+# earliest one. Changing a schedule pushes a new entry with a fresh version;
+# the old entry is skipped when it surfaces, so nothing else is recomputed.
+
+night_heap = []
+night_entries = {}  # chat_id -> (version of its live heap entry or None if nothing is pending, night settings)
+night_versions = itertools.count()
+night_retry_attempts = {}  # chat_id -> failed attempts of its pending transition
+night_wakeup = asyncio.Event()
+
+def parse_clock(text: str):
+    """Parses 'HH:MM' into a time, or returns None."""
+    match = re.fullmatch(r"(\d{1,2}):(\d{2})", text.strip())
+    if not match or int(match.group(1)) > 23 or int(match.group(2)) > 59:
+        return None
+    return dt_time(int(match.group(1)), int(match.group(2)))
+
+def is_night(night: dict, now: datetime) -> bool:
+    local = now.astimezone(ZoneInfo(night["tz"])).time()
+    start, end = parse_clock(night["start"]), parse_clock(night["end"])
+    if start < end:
+        return start <= local < end
+    return local >= start or local < end
+
+def next_night_transition(night: dict, now: datetime):
+    """Returns (when, lock) for the first start/end of the night strictly after `now`."""
+    tz = ZoneInfo(night["tz"])
+    local_now = now.astimezone(tz)
+    candidates = []
+    for days in (0, 1):
+        day = local_now.date() + timedelta(days=days)
+        for clock, lock in ((night["start"], True), (night["end"], False)):
+            when = datetime.combine(day, parse_clock(clock), tzinfo=tz)
+            if when > local_now:
+                candidates.append((when, lock))
+    return min(candidates, key=lambda candidate: candidate[0])
+
+def update_night_schedule(chat_id: int, night: dict):
+    """Replaces the chat's pending transition after its night settings changed."""
+    now = datetime.now(timezone.utc)
+    enabled = bool(night and night.get("enabled"))
+    should_lock = enabled and is_night(night, now)
+
+    if should_lock != bool(night and night.get("locked")):
+        # Out of sync (schedule just changed, or the bot was down over a transition): fix it now.
+        when, lock = now, should_lock
+    elif enabled:
+        when, lock = next_night_transition(night, now)
+    else:
+        # Keep the settings (and lock state) around for the next change, with nothing pending.
+        night_entries[chat_id] = (None, night)
+        return
+
+    version = next(night_versions)
+    night_entries[chat_id] = (version, night)
+    heapq.heappush(night_heap, (when.timestamp(), version, chat_id, lock))
+    night_wakeup.set()
+
+async def load_night_schedules():
+    count = 0
+    # Also load groups left locked after night mode was disabled, so they get unlocked.
+    query = {"$or": [{"night.enabled": True}, {"night.locked": True}]}
+    async for chat_doc in chat_collection.find(query, {"chat_id": 1, "night": 1}):
+        update_night_schedule(chat_doc["chat_id"], chat_doc["night"])
+        count += 1
+    logger.info(f"Loaded night mode schedules for {count} groups.")
+
+def is_locked_permissions(permissions) -> bool:
+    """True for permissions that allow nothing, i.e. what night mode itself sets."""
+    return permissions is None or not any(permissions.to_dict().values())
+
+async def apply_night_transition(bot, chat_id: int, lock: bool):
+    if chat_id not in night_entries:
+        return
+    version, night = night_entries[chat_id]
+
+    # Decide from the current time and state rather than trusting `lock`: a retried entry may have
+    # outlived its window, and a failed earlier transition must not be assumed to have happened.
+    lock = bool(night.get("enabled")) and is_night(night, datetime.now(timezone.utc))
+    if lock == bool(night.get("locked")):
+        night_retry_attempts.pop(chat_id, None)
+        update_night_schedule(chat_id, night)
+        return
+
+    try:
+        if lock:
+            chat = await bot.get_chat(chat_id)
+            if is_locked_permissions(chat.permissions):
+                # Already locked (e.g. by an earlier attempt): saving these would make every unlock a lock.
+                saved_permissions = night.get("saved_permissions")
+            else:
+                saved_permissions = chat.permissions.to_dict()
+            await bot.set_chat_permissions(chat_id, ChatPermissions.no_permissions())
+            night = {**night, "locked": True, "saved_permissions": saved_permissions}
+            logger.info(f"Night mode: locked chat {chat_id}.")
+        else:
+            saved_permissions = night.get("saved_permissions")
+            permissions = ChatPermissions.de_json(saved_permissions, bot) if saved_permissions else ChatPermissions(
+                can_send_messages=True,
+                can_send_audios=True,
+                can_send_documents=True,
+                can_send_photos=True,
+                can_send_videos=True,
+                can_send_video_notes=True,
+                can_send_voice_notes=True,
+                can_send_polls=True,
+                can_send_other_messages=True,
+                can_add_web_page_previews=True,
+                can_invite_users=True,
+            )
+            await bot.set_chat_permissions(chat_id, permissions)
+            night = {**night, "locked": False, "saved_permissions": None}
+            logger.info(f"Night mode: unlocked chat {chat_id}.")
+    except RetryAfter as e:
+        logger.warning(f"Flood control during night mode for chat {chat_id}: retrying in {e.retry_after} seconds.")
+        retry_at = time.time() + e.retry_after + 1
+        heapq.heappush(night_heap, (retry_at, version, chat_id, lock))
+        return
+    except Forbidden:
+        logger.info(f"Bot was kicked/blocked from chat {chat_id}. Dropping its night mode schedule.")
+        night_entries.pop(chat_id, None)
+        night_retry_attempts.pop(chat_id, None)
+        return
+    except Exception as e:
+        # Timeouts, network errors, missing rights: nothing changed, so retry the same entry later.
+        attempts = night_retry_attempts.get(chat_id, 0) + 1
+        night_retry_attempts[chat_id] = attempts
+        delay = min(NIGHT_RETRY_DELAY * 2 ** (attempts - 1), NIGHT_MAX_SLEEP)
+        logger.warning(f"Night mode transition failed for chat {chat_id} (attempt {attempts}), retrying in {delay}s: {e}")
+        heapq.heappush(night_heap, (time.time() + delay, version, chat_id, lock))
+        return
+    night_retry_attempts.pop(chat_id, None)
+
+    try:
+        await chat_collection.update_one(
+            {"chat_id": chat_id},
+            {"$set": {"night.locked": night["locked"], "night.saved_permissions": night.get("saved_permissions")}}
+        )
+    except Exception as e:
+        logger.error(f"Failed to store night mode state for chat {chat_id}: {e}")
+
+    # The settings may have been changed while we were busy; keep those, with the lock state we just set.
+    if chat_id in night_entries:
+        latest_night = night_entries[chat_id][1]
+        update_night_schedule(chat_id, {
+            **latest_night,
+            "locked": night["locked"],
+            "saved_permissions": night.get("saved_permissions"),
+        })
+
+async def night_scheduler(app):
+    await mongo_ready.wait()
+    while True:
+        try:
+            # Safe to repeat after a partial load: re-scheduled groups just get a newer heap entry.
+            await load_night_schedules()
+            break
+        except Exception as e:
+            logger.error(f"Failed to load night mode schedules from MongoDB: {e}. Retrying in {MONGO_CONNECT_RETRY} seconds.")
+            await asyncio.sleep(MONGO_CONNECT_RETRY)
+    while True:
+        night_wakeup.clear()
+        now = time.time()
+
+        due = []
+        while night_heap and night_heap[0][0] <= now and len(due) < NIGHT_BATCH_SIZE:
+            _, version, chat_id, lock = heapq.heappop(night_heap)
+            if night_entries.get(chat_id, (None,))[0] == version:
+                due.append((chat_id, lock))
+
+        if due:
+            await asyncio.gather(*(apply_night_transition(app.bot, chat_id, lock) for chat_id, lock in due))
+            await asyncio.sleep(NIGHT_BATCH_PAUSE)
+            continue
+
+        timeout = min(night_heap[0][0] - now, NIGHT_MAX_SLEEP) if night_heap else NIGHT_MAX_SLEEP
+        try:
+            await asyncio.wait_for(night_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+def describe_night(night: dict) -> str:
+    if not night or not night.get("enabled"):
+        return "Night mode is <b>off</b>."
+    return (
+        f"Night mode is <b>on</b>: the group is locked from <b>{night['start']}</b> "
+        f"to <b>{night['end']}</b> ({night['tz']})."
+    )
+
+async def save_night_settings(chat_id: int, night: dict):
+    """Stores the admin-set fields of `night`. The lock state is left to the scheduler, since `night` may be stale."""
+    settings = {field: night[field] for field in NIGHT_SETTINGS_FIELDS if field in night}
+    if not buffer_early_write(write_night_settings, chat_id, settings):
+        await write_night_settings(chat_id, settings)
+
+    # The scheduler's copy has the current lock state; only fall back to `night` if it has none.
+    current_night = night_entries[chat_id][1] if chat_id in night_entries else night
+    update_night_schedule(chat_id, {**current_night, **settings})
+
+async def write_night_settings(chat_id: int, settings: dict):
+    try:
+        await chat_collection.update_one(
+            {"chat_id": chat_id},
+            {"$set": {f"night.{field}": value for field, value in settings.items()}},
+            upsert=True
+        )
+    except Exception as e:
+        logger.error(f"Failed to store night mode settings of chat {chat_id} in MongoDB: {e}")
+
+async def night_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_chat.type not in ["group", "supergroup"]:
+        await update.message.reply_text("This command can only be used in a group chat.")
+        return
+    if not await is_admin(update, update.effective_user.id):
+        await update.message.reply_text("Only admins can use this command.")
+        return
+    if not await require_mongo_ready(update):
+        return
+
+    chat_id = update.effective_chat.id
+    chat_doc = await chat_collection.find_one({"chat_id": chat_id}, {"night": 1})
+    night = (chat_doc or {}).get("night") or {}
+    usage = "Usage: /night 23:00 07:00 [Timezone, e.g. Europe/Rome] or /night off"
+
+    if not context.args:
+        await update.message.reply_text(f"{describe_night(night)}\n{usage}", parse_mode="HTML")
+        return
+
+    if context.args[0].lower() == "off":
+        night = {**night, "enabled": False}
+    else:
+        if len(context.args) < 2 or not parse_clock(context.args[0]) or not parse_clock(context.args[1]):
+            await update.message.reply_text(usage)
+            return
+        start, end = parse_clock(context.args[0]), parse_clock(context.args[1])
+        if start == end:
+            await update.message.reply_text("Start and end of the night must be different.")
+            return
+        tz = context.args[2] if len(context.args) > 2 else night.get("tz", NIGHT_DEFAULT_TZ)
+        try:
+            ZoneInfo(tz)
+        except (ZoneInfoNotFoundError, ValueError):
+            await update.message.reply_text(f"Unknown timezone: {tz}")
+            return
+        night = {**night, "enabled": True, "start": start.strftime("%H:%M"), "end": end.strftime("%H:%M"), "tz": tz}
+
+    await save_night_settings(chat_id, night)
+    await update.message.reply_text(describe_night(night), parse_mode="HTML")
+
+async def show_night_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+
+    action, chat_id_str = query.data.split(":")
+    chat_id = int(chat_id_str)
+
+    if not await require_mongo_ready(update):
+        return
+    chat_doc = await chat_collection.find_one({"chat_id": chat_id}, {"night": 1})
+    night = (chat_doc or {}).get("night") or {}
+
+    if action == "night_toggle":
+        try:
+            chat_admins = await context.bot.get_chat_administrators(chat_id)
+        except (Forbidden, BadRequest) as e:
+            logger.info(f"Could not fetch admins of chat {chat_id} for night mode: {e}")
+            await query.answer("I can't reach that group anymore. Am I still a member?", show_alert=True)
+            return
+        if not any(admin.user.id == query.from_user.id for admin in chat_admins):
+            await query.answer("Only admins of that group can change this.", show_alert=True)
+            return
+        night = {
+            "start": NIGHT_DEFAULT_START,
+            "end": NIGHT_DEFAULT_END,
+            "tz": NIGHT_DEFAULT_TZ,
+            **night,
+            "enabled": not night.get("enabled"),
+        }
+        await save_night_settings(chat_id, night)
+    await query.answer()
+
+    message = (
+        f"<b>Night</b>\n{describe_night(night)}\n\n"
+        "While night mode is active, members can't send messages. "
+        "To change the hours, send <code>/night 23:00 07:00 Europe/Rome</code> in the group."
+    )
+    keyboard = [
+        [InlineKeyboardButton("🌙 Turn off" if night.get("enabled") else "🌙 Turn on", callback_data=f"night_toggle:{chat_id}")],
+        [InlineKeyboardButton("⬅️ Back", callback_data=f"group_settings:{chat_id}")]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+
+    try:
+        await query.edit_message_text(
+            text=message,
+            reply_markup=reply_markup,
+            parse_mode="HTML",
+            disable_web_page_preview=True
+        )
+    except Exception as e:
+        logger.error(f"Error editing message for night settings: {e}")
+        await query.message.reply_text(
+            text=message,
+            reply_markup=reply_markup,
+            parse_mode="HTML",
+            disable_web_page_preview=True
+        )
+
+
 # --- New /reload command ---
 async def reload_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -676,6 +1678,7 @@ async def track_chats(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # === Periodic Announcement ===
 
 async def periodic_announcement(app):
+    await mongo_ready.wait()
     while True:
         chats_to_announce = await chat_collection.find().to_list(length=None)
         
@@ -699,14 +1702,14 @@ async def periodic_announcement(app):
                     except Exception as e:
                         logger.warning(f"Failed to pin message in chat {chat_id} ('{chat_title}'): {e}")
                     
-                    await asyncio.sleep(300) # Wait for 5 minutes
-                    
-                    try:
-                        await msg.unpin()
-                        await msg.delete()
-                        logger.info(f"Unpinned and deleted message in chat {chat_id} ('{chat_title}').")
-                    except Exception as e:
-                        logger.warning(f"Failed to unpin/delete message in chat {chat_id} ('{chat_title}'): {e}")
+                    # Removal is persisted so it still happens if the bot restarts in the meantime.
+                    await schedule_job(
+                        "remove_announcement",
+                        {"chat_id": chat_id, "message_id": msg.message_id},
+                        ANNOUNCEMENT_PIN_SECONDS
+                    )
+                    # Announcements go out one chat at a time, each while the previous one is pinned.
+                    await asyncio.sleep(ANNOUNCEMENT_PIN_SECONDS)
                 else:
                     logger.info(f"Bot no longer a member of chat {chat_id} ('{chat_title}'). Removing from MongoDB tracking.")
                     await remove_chat_id_from_mongo(chat_id)
@@ -730,21 +1733,21 @@ async def periodic_announcement(app):
 # === On startup / On shutdown ===
 
 async def on_startup(app):
-    await init_mongo_client()
+    # Connecting and index checks run in the background so the webhook is served right away.
+    init_mongo_client()
+    app.create_task(connect_mongo())
     app.create_task(periodic_announcement(app))
+    app.create_task(delayed_job_worker(app))
+    app.create_task(night_scheduler(app))
+    app.create_task(warn_flusher(app))
 
 async def on_shutdown(app):
     if mongo_client:
+        await flush_warns()
         mongo_client.close()
     logger.info("MongoDB client closed.")
 
-def main():
-    token = os.getenv("BOT_TOKEN")
-    if not token:
-        raise RuntimeError("BOT_TOKEN not set")
-
-    port = int(os.environ.get("PORT", 8000))
-    
+def build_application(token: str):
     app = ApplicationBuilder().token(token)\
         .post_init(on_startup)\
         .post_shutdown(on_shutdown)\
@@ -753,6 +1756,12 @@ def main():
         .write_timeout(20)\
         .build()
 
+    # Runs before every other handler (group -1) and stops processing of re-delivered updates.
+    # The webhook already answers Telegram with 200 as soon as an update is queued, so
+    # slow handlers never delay the acknowledgement; this only guards against retries
+    # that arrived anyway.
+    app.add_handler(TypeHandler(Update, drop_duplicate_updates), group=-1)
+
     app.add_handler(CommandHandler("start", start))
     app.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, welcome))    
     app.add_handler(CommandHandler("rules", rules))
@@ -762,9 +1771,13 @@ def main():
     app.add_handler(CommandHandler("mute", mute))
     app.add_handler(CommandHandler("promote", promote))
     app.add_handler(CommandHandler("demote", demote))
+    app.add_handler(CommandHandler("warn", warn))
+    app.add_handler(CommandHandler("unwarn", unwarn))
+    app.add_handler(CommandHandler("warns", warns))
     
     app.add_handler(CommandHandler("settings", settings_command))
     app.add_handler(CommandHandler("reload", reload_command))
+    app.add_handler(CommandHandler("night", night_command))
     
     app.add_handler(MessageHandler(filters.ChatType.GROUPS & filters.ALL, track_chats))    
 
@@ -773,12 +1786,23 @@ def main():
     app.add_handler(CallbackQueryHandler(help_command, pattern="^show_bot_commands$"))
     app.add_handler(CallbackQueryHandler(start, pattern="^back_to_main_menu$"))
     
-    app.add_handler(CallbackQueryHandler(lang_menu, pattern="^lang_menu$"))
+    app.add_handler(CallbackQueryHandler(lang_menu, pattern="^(lang_menu$|setting_lang:)"))
     app.add_handler(CallbackQueryHandler(set_language, pattern="^set_lang:"))
     
     app.add_handler(CallbackQueryHandler(show_group_settings, pattern="^group_settings:"))
     app.add_handler(CallbackQueryHandler(show_other_settings, pattern="^setting_other:")) # NEW Handler for 'Other' button
+    app.add_handler(CallbackQueryHandler(show_night_settings, pattern="^(setting_night|night_toggle):"))
     app.add_handler(CallbackQueryHandler(settings_command, pattern="^back_to_settings_list$"))
+    app.add_handler(CallbackQueryHandler(settings_command, pattern="^settings_page:[<>]-?\\d+$"))
+    return app
+
+def main():
+    token = os.getenv("BOT_TOKEN")
+    if not token:
+        raise RuntimeError("BOT_TOKEN not set")
+
+    port = int(os.environ.get("PORT", 8000))
+    app = build_application(token)
 
     webhook_url_from_env = os.getenv("WEBHOOK_URL")    
     logger.info(f"WEBHOOK_URL read from environment: {webhook_url_from_env}")    